@@ -2,18 +2,33 @@ import os
 import io
 import ebooklib
 from ebooklib import epub
-from flask import Flask, render_template, request, redirect, url_for, flash, session, abort, Response, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, abort, Response, jsonify, send_file
+from flask.sessions import SecureCookieSessionInterface
+from flask.json.provider import DefaultJSONProvider
+import orjson
 import tempfile
 from werkzeug.utils import secure_filename
-from bs4 import BeautifulSoup, NavigableString
 import mimetypes
 import posixpath
 from dotenv import load_dotenv
 from openai import OpenAI
 import hashlib
 import fugashi
-import html
 import logging
+import zipfile
+import zlib
+import re
+import uuid
+import sys
+import time
+import glob
+import threading
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from lxml import etree
+from lxml import html as lxml_html
 
 load_dotenv()
 
@@ -22,9 +37,38 @@ app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'supersecretkey-fa
 app.config['OPENAI_API_KEY'] = os.environ.get('OPENAI_API_KEY')
 app.config['SERVER_DEFAULT_MODEL'] = os.environ.get('DEFAULT_MODEL', 'gpt-4o-mini')
 
+# orjson for request/response JSON: /translate moves whole chapters of HTML both ways
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app.json = OrjsonProvider(app)
+
 ALLOWED_EXTENSIONS = {'epub'}
+UPLOAD_CHUNK_SIZE = 1 << 20 # 1 MiB reads when streaming an upload to disk
+
+# --- Session Interface (Start) ---
+# Image URLs carry the book id themselves, so image requests never need the session.
+# Handing them a null session skips cookie verification; Flask also skips saving null sessions.
+class ImageRequestSessionInterface(SecureCookieSessionInterface):
+    def open_session(self, app, request):
+        if request.path.startswith('/image/'):
+            return self.make_null_session(app)
+        return super().open_session(app, request)
+
+app.session_interface = ImageRequestSessionInterface()
+# --- Session Interface (End) ---
 
 # --- Logging Configuration (Start) ---
+# App diagnostics go through this logger; per-request chatter is DEBUG, so by default the
+# hot paths (images, chapters) skip formatting and the stream write entirely.
+# Set LOG_LEVEL=DEBUG to see it.
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(levelname)s %(name)s: %(message)s')
+log = logging.getLogger(__name__)
+
 # Get the Werkzeug logger (used by Flask's dev server)
 werkzeug_logger = logging.getLogger('werkzeug')
 
@@ -45,60 +89,196 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+ZIP_SIGNATURE = b'PK\x03\x04'
+EPUB_MIMETYPE = b'application/epub+zip'
+
+def looks_like_epub(path):
+    """Cheap content sniff so junk uploads are rejected before a full EPUB parse."""
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(ZIP_SIGNATURE)) != ZIP_SIGNATURE:
+                return False
+        with zipfile.ZipFile(path) as zf:
+            try:
+                mimetype = zf.read('mimetype')
+            except KeyError:
+                return True # The spec requires a 'mimetype' member; tolerate books that omit it
+            return mimetype.strip().startswith(EPUB_MIMETYPE)
+    # Corrupt or truncated archives, and members using a compression method zipfile can't read
+    except (zipfile.BadZipFile, zlib.error, NotImplementedError, EOFError, OSError):
+        return False
+
+# lxml refuses str input that still carries an XML encoding declaration
+XML_DECLARATION_RE = re.compile(r'^\s*<\?xml[^>]*\?>')
+
+def rewrite_chapter(item, image_url):
+    """Returns the chapter's HTML with every img src pointed at image_url(absolute href)."""
+    # One decode pass; invalid bytes become U+FFFD instead of triggering a second decode
+    html_content = item.get_content().decode('utf-8', 'replace')
+
+    # Rewrite image paths in the original content
+    try:
+        tree = lxml_html.document_fromstring(XML_DECLARATION_RE.sub('', html_content, count=1))
+    except etree.ParserError: # Empty document; don't fail the whole book over it
+        return ''
+    current_item_dir = posixpath.dirname(item.file_name)
+    for img in tree.xpath('//img[@src != ""]'): # Empty src attributes are left alone
+        absolute_image_path = posixpath.normpath(posixpath.join(current_item_dir, img.get('src')))
+        img.set('src', image_url(absolute_image_path))
+
+    return lxml_html.tostring(tree, encoding='unicode')
+
+# --- HTTP Caching (Start) ---
+IMAGE_CACHE_CONTROL = 'private, max-age=86400, immutable'
+READ_CACHE_CONTROL = 'private, no-cache'
+FALLBACK_CACHE_CONTROL = 'no-store' # A degraded page (e.g. JLPT unavailable) must not be revalidated
+
+def not_modified(etag, cache_control):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+# --- HTTP Caching (End) ---
+
+# --- Book State (Start) ---
+# Spine, ToC and temp path are kept server-side; the session cookie only carries
+# a short 'book_id', so it stays tiny and isn't re-signed with the whole ToC each response.
+_book_state = {} # book id -> {'temp_epub_path': ..., 'spine_ids': [...], 'chapter_paths': [...], 'toc_list': [...], 'last_access': ..., 'last_touch': ...}
+
+# last_access only lives in this process; other processes' reapers (gunicorn workers, the
+# reloader's watcher) go by the EPUB's mtime, so bump it too, at most once a minute
+TOUCH_INTERVAL = 60
+
+def get_book_state():
+    book_id = session.get('book_id')
+    book_state = _book_state.get(book_id) if book_id else None
+    if book_state:
+        now = time.time()
+        # Timed separately from last_access, which every read resets
+        if now - book_state['last_touch'] > TOUCH_INTERVAL:
+            try:
+                os.utime(book_state['temp_epub_path'])
+                book_state['last_touch'] = now
+            except OSError as e:
+                log.warning("Could not touch %s: %s", book_state['temp_epub_path'], e)
+        book_state['last_access'] = now # Keeps the book away from the reaper
+    return book_state
+
+def book_files(book_state):
+    # The EPUB itself plus the pre-rendered chapter sidecars written next to it, and the
+    # highlighted copies (see load_jlpt_chapter) which only exist once viewed with JLPT on
+    chapter_paths = book_state['chapter_paths']
+    return [book_state['temp_epub_path']] + chapter_paths + [jlpt_chapter_path(path) for path in chapter_paths]
+# --- Book State (End) ---
+
+# --- Image Index (Start) ---
+# Images are served straight out of the EPUB zip: the manifest is walked once per book
+# to map normalized hrefs to zip members, then each request is a single member read.
+CONTAINER_NS = '{urn:oasis:names:tc:opendocument:xmlns:container}'
+_image_index = {} # temp path -> {normalized href: (zip member name, mime type)}
+_zip_files = {} # temp path -> open ZipFile
+
+# Fallback when mimetypes doesn't know an extension - common for EPUB images
+IMAGE_EXT_MIME = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.svg': 'image/svg+xml',
+    '.webp': 'image/webp',
+}
+
+def guess_image_mime(href):
+    # The table covers nearly every EPUB image; mimetypes only for the odd .bmp/.tif
+    mime_type = IMAGE_EXT_MIME.get(posixpath.splitext(href)[1].lower())
+    if not mime_type:
+        mime_type, _ = mimetypes.guess_type(href)
+    return mime_type or 'application/octet-stream' # Generic fallback
+
+def build_image_index(temp_path, book):
+    # Manifest hrefs are relative to the OPF file, zip members to the archive root
+    with zipfile.ZipFile(temp_path) as zf:
+        container = etree.fromstring(zf.read('META-INF/container.xml'))
+    rootfile = container.find(f'.//{CONTAINER_NS}rootfile')
+    opf_dir = posixpath.dirname(rootfile.get('full-path'))
+
+    index = {}
+    for item in book.get_items():
+        if item.get_type() in (ebooklib.ITEM_IMAGE, ebooklib.ITEM_COVER):
+            href = posixpath.normpath(item.file_name)
+            member = posixpath.normpath(posixpath.join(opf_dir, item.file_name))
+            # The manifest's media-type is authoritative; only guess from the name without one
+            index[href] = (member, item.media_type or guess_image_mime(href))
+    _image_index[temp_path] = index
+    return index
+
+def get_image_index(temp_path):
+    # Built by process_epub before the book is published in _book_state
+    return _image_index.get(temp_path, {})
+
+def get_zip_file(temp_path):
+    zf = _zip_files.get(temp_path)
+    if zf is None:
+        zf = _zip_files[temp_path] = zipfile.ZipFile(temp_path, 'r')
+    return zf
+
+def evict_image_index(temp_path):
+    _image_index.pop(temp_path, None)
+    zf = _zip_files.pop(temp_path, None)
+    if zf:
+        zf.close()
+# --- Image Index (End) ---
+
 # Helper function to extract Toc mapping to spine index
-def get_toc_list(book, spine_ids):
+def get_toc_list(toc, spine_ids, items_by_id):
     toc_list = []
     spine_file_map = {}
     # Create a map from item file_name (without anchor) to its index in the spine_ids list
     for index, item_id in enumerate(spine_ids):
-        item = book.get_item_with_id(item_id)
+        item = items_by_id.get(item_id)
         if item and item.file_name:
-            base_filename = item.file_name.split('#')[0]
+            # find/slice instead of split: no throwaway list per item
+            file_name = item.file_name
+            pos = file_name.find('#')
+            base_filename = file_name if pos < 0 else file_name[:pos]
             if base_filename not in spine_file_map:
                 spine_file_map[base_filename] = index
 
-    # Recursive function to process ToC items (Links and Sections)
-    def process_toc_item(item):
+    # Walk the ToC (Links, Sections and (Section, [children]) tuples) with an explicit
+    # stack rather than recursion; children are pushed reversed to keep document order
+    seen_indices = set()
+    stack = list(reversed(toc))
+    while stack:
+        item = stack.pop()
         # Handle ebooklib.epub.Link
         if isinstance(item, ebooklib.epub.Link):
-            href_filename = item.href.split('#')[0]
-            if href_filename in spine_file_map:
-                item_index = spine_file_map[href_filename]
+            href = item.href
+            pos = href.find('#')
+            href_filename = href if pos < 0 else href[:pos]
+            item_index = spine_file_map.get(href_filename)
+            # Several entries often point into one chapter; keep only the first
+            if item_index is not None and item_index not in seen_indices:
+                seen_indices.add(item_index)
                 toc_list.append({
                     'title': item.title or "(No Title)", # Use title attribute
                     'index': item_index,
-                    'href': item.href
+                    'href': href
                 })
         # Handle ebooklib.epub.Section (which might contain links or subsections)
         elif isinstance(item, ebooklib.epub.Section):
             # Sections themselves might not directly link, but their children do.
-            # Optionally add section title if needed, but usually links are sufficient.
-            # print(f"Processing Section: {item.title}")
-            for child_item in item.children:
-                process_toc_item(child_item) # Recurse on children
+            # Current ebooklib Sections carry no children (they arrive via tuples), hence getattr
+            stack.extend(reversed(getattr(item, 'children', [])))
         # Handle nested Tuples like (Section, [Link, Link, ...])
         elif isinstance(item, tuple) and len(item) > 0:
+             # If the second element is a list (potential children), process them after the first
+             if len(item) > 1 and isinstance(item[1], list):
+                 stack.extend(reversed(item[1]))
              # If the first element is Section or Link, process it
              if isinstance(item[0], (ebooklib.epub.Section, ebooklib.epub.Link)):
-                 process_toc_item(item[0])
-             # If the second element is a list (potential children), process them
-             if len(item) > 1 and isinstance(item[1], list):
-                 for child_item in item[1]:
-                     process_toc_item(child_item)
-
-    # Iterate through the root Table of Contents structure
-    for root_item in book.toc:
-        process_toc_item(root_item)
+                 stack.append(item[0])
 
-    # Remove duplicates based on index, preserving the first occurrence
-    seen_indices = set()
-    unique_toc = []
-    for entry in toc_list:
-        if entry['index'] not in seen_indices:
-            unique_toc.append(entry)
-            seen_indices.add(entry['index'])
-
-    return unique_toc
+    return toc_list
 
 # --- JLPT Highlighting (Start) ---
 # Very basic hardcoded JLPT dictionary for demo
@@ -113,68 +293,353 @@ JLPT_DICT = {
     # Add more words as needed for testing
 }
 
+# Elements likely to contain main text content
+# Adjust as needed based on EPUB structure
+JLPT_CONTENT_TAGS = ('p', 'div', 'span', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+# Cheap gate run before MeCab: a node can only hold a JLPT word if it contains the word's
+# stem (its lemma minus trailing okurigana, which conjugation rewrites), so nodes without
+# any stem are never tokenized. Longest first so the alternation prefers the full match.
+def _jlpt_stem(lemma):
+    stem = lemma.rstrip(''.join(chr(c) for c in range(0x3041, 0x3097)))
+    return stem or lemma
+
+_JLPT_CANDIDATE_RE = re.compile('|'.join(
+    re.escape(stem) for stem in sorted({_jlpt_stem(w) for w in JLPT_DICT}, key=len, reverse=True)))
+
+# Lemma -> span class, so the token loop is one dict hit with nothing to format
+JLPT_CLASSES = {word: level.lower() for word, level in JLPT_DICT.items()}
+
+def jlpt_fragments(tagger, text):
+    """Splits text into leading plain text plus <span> elements for JLPT words, each
+    span's tail carrying the plain text that follows it."""
+    lead = []
+    spans = []
+    consumed = 0
+    classes = JLPT_CLASSES
+    for token in tagger(text):
+        css_class = classes.get(token.feature.lemma)
+        if css_class:
+            # Whitespace MeCab skipped before the word stays outside the span
+            if spans: spans[-1].tail += token.white_space
+            else: lead.append(token.white_space)
+            span = etree.Element('span', {'class': css_class})
+            span.text = token.surface
+            span.tail = ''
+            spans.append(span)
+        elif spans:
+            spans[-1].tail += token.white_space + token.surface
+        else:
+            lead.append(token.white_space + token.surface)
+        consumed += len(token.white_space) + len(token.surface)
+    # Trailing whitespace isn't attached to any token
+    if spans: spans[-1].tail += text[consumed:]
+    else: lead.append(text[consumed:])
+    return ''.join(lead), spans
+
+# Loading the MeCab dictionary dominates Tagger() construction, so build it once per
+# process, on first use. A MeCab tagger isn't safe to share between threads, hence the lock.
+_TAGGER = None
+_TAGGER_LOCK = threading.Lock()
+
+def _get_tagger():
+    global _TAGGER
+    if _TAGGER is None:
+        _TAGGER = fugashi.Tagger()
+    return _TAGGER
+
 def add_jlpt_highlighting(html_content):
-    """Tokenizes Japanese text and adds JLPT level spans."""
+    """Tokenizes Japanese text and adds JLPT level spans. Returns None on failure."""
     try:
-        tagger = fugashi.Tagger()
-        soup = BeautifulSoup(html_content, 'lxml')
-
-        # Find elements likely to contain main text content
-        # Adjust selectors as needed based on EPUB structure
-        content_tags = soup.find_all(['p', 'div', 'span', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
-
-        for tag in content_tags:
-            new_contents = []
-            for child in tag.contents:
-                if isinstance(child, NavigableString) and child.strip():
-                    text = str(child)
-                    tokens = tagger(text)
-                    current_frag = []
-                    for token in tokens:
-                        lemma = token.feature.lemma
-                        surface = token.surface
-                        level = JLPT_DICT.get(lemma)
-                        if level:
-                            # Create a new span tag for the highlighted word
-                            span_tag = soup.new_tag("span", attrs={"class": level.lower()})
-                            span_tag.string = html.escape(surface)
-                            current_frag.append(span_tag)
-                        else:
-                            # Append the non-highlighted text directly
-                            current_frag.append(html.escape(surface))
-                    # Replace the original string with the list of new strings/tags
-                    new_contents.extend(current_frag)
-                else:
-                    # Keep non-string elements (like <a>, <img>, etc.) as they are
-                    new_contents.append(child)
-            
-            # Replace the tag's original contents with the new list
-            tag.clear()
-            for item in new_contents:
-                tag.append(item)
-
-        return str(soup)
+        tree = lxml_html.document_fromstring(html_content)
+
+        with _TAGGER_LOCK:
+            tagger = _get_tagger()
+            # Snapshot first: the spans added below must not be visited themselves
+            for tag in list(tree.iter(*JLPT_CONTENT_TAGS)):
+                # A tag's own text lives in .text and in each child's .tail (comments included)
+                children = list(tag)
+                if tag.text and _JLPT_CANDIDATE_RE.search(tag.text):
+                    tag.text, spans = jlpt_fragments(tagger, tag.text)
+                    for position, span in enumerate(spans):
+                        tag.insert(position, span)
+                for child in children:
+                    if child.tail and _JLPT_CANDIDATE_RE.search(child.tail):
+                        child.tail, spans = jlpt_fragments(tagger, child.tail)
+                        for span in reversed(spans):
+                            child.addnext(span)
+
+        return lxml_html.tostring(tree, encoding='unicode')
     except Exception as e:
-        print(f"Error during JLPT highlighting: {e}")
-        return html_content # Return original content on error
+        log.error("Error during JLPT highlighting: %s", e)
+        # Not the input: from a pool worker it would come back as an equal but new string,
+        # indistinguishable from a successful result
+        return None
+
+# Tagging is CPU-bound and the lock above lets only one thread tag at a time, so chapters
+# are highlighted in a small process pool instead. Each worker loads its own dictionary
+# once when it starts. Started lazily, so processes that never toggle JLPT pay nothing.
+JLPT_WORKERS = 2
+JLPT_TIMEOUT = 30 # Seconds to wait for a worker before showing the chapter unhighlighted
+_jlpt_pool = None
+_jlpt_pool_lock = threading.Lock()
+
+def _init_jlpt_worker():
+    _get_tagger()
+
+def get_jlpt_pool():
+    global _jlpt_pool
+    with _jlpt_pool_lock:
+        if _jlpt_pool is None:
+            # spawn, not fork: this process already runs threads (reaper, upload executor)
+            _jlpt_pool = ProcessPoolExecutor(max_workers=JLPT_WORKERS, initializer=_init_jlpt_worker,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return _jlpt_pool
+
+# Hiragana, katakana, CJK ideographs (incl. extension A) and half-width katakana
+JAPANESE_TEXT_RE = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uff66-\uff9f]')
+
+def highlight_jlpt(html_content):
+    """Returns the highlighted chapter, or None if highlighting couldn't be done."""
+    global _jlpt_pool
+    # English front matter, copyright pages etc.: nothing to tag, so skip the round trip,
+    # the parse and the re-serialisation altogether
+    if not JAPANESE_TEXT_RE.search(html_content):
+        return html_content
+    # Highlighting is optional: whatever goes wrong with the pool, the caller falls back to
+    # the plain chapter
+    pool = None
+    future = None
+    try:
+        pool = get_jlpt_pool()
+        future = pool.submit(add_jlpt_highlighting, html_content)
+        return future.result(timeout=JLPT_TIMEOUT)
+    except BrokenProcessPool as e:
+        # A worker died (e.g. OOM-killed); start a fresh pool next time, tag inline now
+        log.warning("JLPT worker pool broke, highlighting inline: %s", e)
+        with _jlpt_pool_lock:
+            if _jlpt_pool is pool:
+                _jlpt_pool = None
+        return add_jlpt_highlighting(html_content)
+    except FutureTimeoutError:
+        future.cancel()
+        log.error("JLPT highlighting timed out after %ss, showing the chapter unhighlighted", JLPT_TIMEOUT)
+        return None
+    except Exception as e:
+        log.error("JLPT worker pool failed, showing the chapter unhighlighted: %s", e)
+        return None
+
+def jlpt_chapter_path(chapter_path):
+    return chapter_path[:-len('.html')] + '.jlpt.html'
+
+def load_jlpt_chapter(chapter_path):
+    """Returns (html, highlighted): the highlighted chapter, tagging it on first view and
+    keeping the result next to the plain sidecar so revisits are a single file read. If
+    highlighting fails, the plain chapter comes back with highlighted=False."""
+    jlpt_path = jlpt_chapter_path(chapter_path)
+    try:
+        with open(jlpt_path, 'rb') as f:
+            return f.read().decode('utf-8'), True
+    except FileNotFoundError:
+        pass
+    with open(chapter_path, 'rb') as f:
+        content = f.read().decode('utf-8')
+    highlighted = highlight_jlpt(content)
+    if highlighted is None:
+        return content, False
+    if highlighted == content:
+        # Nothing to tag: don't keep a plain copy as the highlighted one
+        return highlighted, True
+    # Write-then-rename so a concurrent request never reads a half-written file
+    partial_path = f'{jlpt_path}.{uuid.uuid4().hex}.tmp'
+    try:
+        with open(partial_path, 'w', encoding='utf-8') as f:
+            f.write(highlighted)
+        os.replace(partial_path, jlpt_path)
+    except OSError as e:
+        # The cache is only an optimisation (disk full, permissions...); still serve the page
+        log.error("Could not cache highlighted chapter %s: %s", jlpt_path, e)
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+    return highlighted, True
 # --- JLPT Highlighting (End) ---
 
-# Helper to clean up old temp file path from session
-def cleanup_temp_file(path_key='temp_epub_path'):
-    old_temp_path = session.pop(path_key, None)
-    # Remove book-specific session data
-    session.pop('spine_ids', None)
-    session.pop('toc_list', None)
+# Helper to clean up the current book's temp files and server-side state
+def cleanup_temp_file():
+    book_state = _book_state.pop(session.pop('book_id', None), None)
     # Reset JLPT highlighting state when cleaning up book
     session.pop('jlpt_enabled', None)
     # session.pop('book_language', None) # No longer storing book language here
-    # NOTE: Server-side caches removed, client handles caching now
-    if old_temp_path and os.path.exists(old_temp_path):
+    if book_state:
+        evict_image_index(book_state['temp_epub_path'])
+        for old_temp_path in book_files(book_state):
+            if os.path.exists(old_temp_path):
+                try:
+                    os.remove(old_temp_path)
+                    log.debug("Cleaned up temp file: %s", old_temp_path)
+                except OSError as e:
+                    log.error("Error deleting old temp file %s: %s", old_temp_path, e)
+
+# --- EPUB Processing (Start) ---
+# Parsing and ToC construction run on a small pool so a large upload doesn't hold a
+# request worker; the upload page polls /upload_status/<job_id> until the job is done.
+executor = ThreadPoolExecutor(max_workers=2)
+_upload_jobs = {} # job id -> (Future resolving to a book id (None if the spine is empty), submit time)
+
+def remove_temp_file(path):
+    if os.path.exists(path):
         try:
-            os.remove(old_temp_path)
-            print(f"Cleaned up temp file: {old_temp_path}")
+            os.remove(path)
+            log.info("Cleaned up temp file after error: %s", path)
         except OSError as e:
-            print(f"Error deleting old temp file {old_temp_path}: {e}")
+            log.error("Error deleting temp file %s after error: %s", path, e)
+
+def process_epub(temp_file_path, book_id, url_adapter):
+    """Parses an uploaded EPUB into server-side book state and pre-renders every chapter.
+    Runs on the executor, so it must not touch the request, session or flashes; image
+    URLs are built with url_adapter, which the upload request binds for it."""
+    processing_successful = False
+    chapter_paths = []
+    try:
+        # Parsed once: chapters and the image index are all derived here, so nothing
+        # needs the Book (which holds every item's bytes) after this returns
+        book = epub.read_epub(temp_file_path, options={"ignore_ncx": True})
+        # book.get_item_with_id scans every manifest item, so index them once
+        items_by_id = {it.id: it for it in book.get_items()}
+
+        spine_ids = []
+        spine_items = []
+        if book.spine:
+            for item_id, _ in book.spine:
+                item = items_by_id.get(item_id)
+                if item and item.get_type() == ebooklib.ITEM_DOCUMENT:
+                    # Interned: one shared copy per id for the lifetime of the book state
+                    spine_ids.append(sys.intern(item_id))
+                    spine_items.append(item)
+
+        if not spine_ids:
+            return None
+
+        # Get the Table of Contents mapped to spine indices.
+        # ignore_ncx reads the EPUB3 nav (NCX is still used when there's no nav);
+        # only re-parse with the NCX if the nav yielded nothing.
+        toc_book = book if book.toc else epub.read_epub(temp_file_path, options={"ignore_ncx": False})
+        # Same manifest either way, so the cached id index serves both books
+        toc_list = get_toc_list(toc_book.toc, spine_ids, items_by_id)
+        build_image_index(temp_file_path, book)
+
+        # Rewrite every chapter once now so read_item is a plain file read
+        def image_url(href):
+            return url_adapter.build('serve_epub_image', {'book_id': book_id, 'image_href': href})
+
+        for index, item in enumerate(spine_items):
+            chapter_path = f'{temp_file_path}.{index}.html'
+            chapter_paths.append(chapter_path)
+            with open(chapter_path, 'w', encoding='utf-8') as f:
+                f.write(rewrite_chapter(item, image_url))
+
+        _book_state[book_id] = {
+            'temp_epub_path': temp_file_path,
+            'spine_ids': spine_ids,
+            'chapter_paths': chapter_paths,
+            'toc_list': toc_list,
+            'last_access': time.time(),
+            'last_touch': os.path.getmtime(temp_file_path),
+        }
+        processing_successful = True
+        log.info("Stored temp file: %s, %d spine items, %d ToC items for book %s.", temp_file_path, len(spine_ids), len(toc_list), book_id)
+        return book_id
+    finally:
+        # Only delete the temp files here if processing *failed*
+        if not processing_successful:
+            # The image index may already be built; nothing else would ever evict it
+            evict_image_index(temp_file_path)
+            for path in [temp_file_path] + chapter_paths:
+                remove_temp_file(path)
+
+def finish_upload(future):
+    """Binds a finished processing job to the current session and returns where to go next."""
+    try:
+        book_id = future.result()
+    except Exception as e:
+        log.exception("Error processing EPUB: %s", e)
+        flash(f'Could not process EPUB file: {e}')
+        return url_for('index')
+
+    if not book_id:
+        flash('EPUB has no readable content in its spine.')
+        return url_for('index')
+
+    # Reset JLPT toggle state for new book (default to off)
+    session['jlpt_enabled'] = False
+    session['book_id'] = book_id
+    return url_for('read_item', item_index=0)
+# --- EPUB Processing (End) ---
+
+# --- Temp File Reaper (Start) ---
+# cleanup_temp_file only sees the current session's book. Books whose tab was closed or
+# whose session expired, and files left behind by a crash, are swept up here instead.
+TEMP_FILE_PREFIX = 'progressivereader-'
+TEMP_FILE_MAX_AGE = 60 * 60 # Seconds a book may sit unread before it is reaped
+REAP_INTERVAL = 10 * 60
+
+def reap_temp_files():
+    now = time.time()
+    # Jobs whose page was closed before polling them to completion; their book, if any,
+    # is an ordinary idle book and is reaped below
+    for job_id, (future, submitted) in list(_upload_jobs.items()):
+        if future.done() and now - submitted > TEMP_FILE_MAX_AGE:
+            _upload_jobs.pop(job_id, None)
+    stale_paths = []
+    for book_id, book_state in list(_book_state.items()):
+        if now - book_state['last_access'] > TEMP_FILE_MAX_AGE:
+            _book_state.pop(book_id, None)
+            evict_image_index(book_state['temp_epub_path'])
+            stale_paths.extend(book_files(book_state))
+
+    live_paths = {path for book_state in list(_book_state.values()) for path in book_files(book_state)}
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), TEMP_FILE_PREFIX + '*')):
+        if path in live_paths:
+            continue
+        # Sidecars (<temp>.epub.<i>.html etc.) live as long as their EPUB, whose mtime
+        # get_book_state refreshes while the book is being read
+        pos = path.find('.epub')
+        owner_path = path[:pos + len('.epub')] if pos >= 0 else path
+        try:
+            age = now - os.path.getmtime(owner_path if os.path.exists(owner_path) else path)
+            # Age check leaves uploads that are still being written or parsed alone
+            if path in stale_paths or age > TEMP_FILE_MAX_AGE:
+                os.remove(path)
+                log.info("Reaped abandoned temp file: %s", path)
+        except OSError as e:
+            log.error("Error reaping temp file %s: %s", path, e)
+
+def schedule_reaper():
+    reap_temp_files()
+    timer = threading.Timer(REAP_INTERVAL, schedule_reaper)
+    timer.daemon = True
+    timer.start()
+
+# Started by the first request rather than at import: the reloader's watcher, JLPT pool
+# workers, `flask shell` etc. import this module too but serve no books of their own
+_reaper_started = False
+_reaper_lock = threading.Lock()
+
+@app.before_request
+def start_reaper():
+    global _reaper_started
+    if _reaper_started:
+        return
+    with _reaper_lock:
+        if not _reaper_started:
+            _reaper_started = True
+            # Sweep leftovers from a previous run right away (off the request), then every REAP_INTERVAL
+            timer = threading.Timer(0, schedule_reaper)
+            timer.daemon = True
+            timer.start()
+# --- Temp File Reaper (End) ---
 
 @app.route('/')
 def index():
@@ -184,74 +649,86 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    if 'file' not in request.files:
-        flash('No file part')
-        return redirect(url_for('index'))
-    file = request.files['file']
-    if file.filename == '':
+    # The upload page sends the file as a raw request body (application/octet-stream,
+    # filename in the query string) which is copied straight to disk, bypassing Werkzeug's
+    # multipart parser. Plain form posts are still accepted as a fallback without JS.
+    streamed = request.mimetype == 'application/octet-stream'
+
+    def respond(location):
+        # fetch() callers navigate themselves; following a redirect would consume the flashes
+        return jsonify({"redirect": location}) if streamed else redirect(location)
+
+    if streamed:
+        file = None
+        filename = request.args.get('filename', '')
+    else:
+        if 'file' not in request.files:
+            flash('No file part')
+            return respond(url_for('index'))
+        file = request.files['file']
+        filename = file.filename
+    if filename == '':
         flash('No selected file')
-        return redirect(url_for('index'))
+        return respond(url_for('index'))
 
-    if file and allowed_file(file.filename):
+    if allowed_file(filename):
         cleanup_temp_file()
         temp_file_path = None
-        processing_successful = False
         try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.epub') as temp_epub:
-                file.save(temp_epub)
+            with tempfile.NamedTemporaryFile(delete=False, prefix=TEMP_FILE_PREFIX, suffix='.epub') as temp_epub:
                 temp_file_path = temp_epub.name
-
-            book = epub.read_epub(temp_file_path)
-
-            spine_ids = []
-            if book.spine:
-                for item_id, _ in book.spine:
-                    item = book.get_item_with_id(item_id)
-                    if item and item.get_type() == ebooklib.ITEM_DOCUMENT:
-                        spine_ids.append(item_id)
-
-            if spine_ids:
-                # Get the Table of Contents mapped to spine indices
-                toc_list = get_toc_list(book, spine_ids)
-
-                # Reset JLPT toggle state for new book (default to off)
-                session['jlpt_enabled'] = False
-
-                session['spine_ids'] = spine_ids
-                session['temp_epub_path'] = temp_file_path
-                session['toc_list'] = toc_list # Store ToC in session
-                processing_successful = True
-                print(f"Stored temp file: {temp_file_path}, {len(spine_ids)} spine items, {len(toc_list)} ToC items in session.")
-                return redirect(url_for('read_item', item_index=0))
-            else:
-                flash('EPUB has no readable content in its spine.')
-                return redirect(url_for('index'))
-
+                if streamed:
+                    while chunk := request.stream.read(UPLOAD_CHUNK_SIZE):
+                        temp_epub.write(chunk)
+                else:
+                    file.save(temp_epub)
         except Exception as e:
-            print(f"Error processing EPUB: {e}")
+            log.error("Error saving uploaded EPUB: %s", e)
             flash(f'Could not process EPUB file: {e}')
-            return redirect(url_for('index'))
-        finally:
-            # Only delete the temp file here if processing *failed*
-            if not processing_successful and temp_file_path and os.path.exists(temp_file_path):
-                try:
-                    os.remove(temp_file_path)
-                    print(f"Cleaned up temp file after error: {temp_file_path}")
-                except OSError as e:
-                    print(f"Error deleting temp file {temp_file_path} after error: {e}")
+            if temp_file_path:
+                remove_temp_file(temp_file_path)
+            return respond(url_for('index'))
+
+        if not looks_like_epub(temp_file_path):
+            log.warning("Rejected upload that is not an EPUB: %s", filename)
+            flash('Invalid file type. Please upload an EPUB file.')
+            remove_temp_file(temp_file_path)
+            return respond(url_for('index'))
+
+        book_id = uuid.uuid4().hex
+        future = executor.submit(process_epub, temp_file_path, book_id, app.create_url_adapter(request))
+        if not streamed:
+            # Plain form posts have no script to poll with, so wait for the job here
+            return redirect(finish_upload(future))
+        job_id = uuid.uuid4().hex
+        _upload_jobs[job_id] = (future, time.time())
+        return jsonify({"status_url": url_for('upload_status', job_id=job_id)}), 202
     else:
         flash('Invalid file type. Please upload an EPUB file.')
-        return redirect(url_for('index'))
+        return respond(url_for('index'))
+
+@app.route('/upload_status/<job_id>')
+def upload_status(job_id):
+    job = _upload_jobs.get(job_id)
+    if job is None:
+        return jsonify({"state": "unknown"}), 404
+    future, _ = job
+    if not future.done():
+        return jsonify({"state": "pending"})
+    if _upload_jobs.pop(job_id, None) is None: # Another poll already finished this job
+        return jsonify({"state": "unknown"}), 404
+    return jsonify({"state": "done", "redirect": finish_upload(future)})
 
 @app.route('/read/<int:item_index>')
 def read_item(item_index):
-    if 'spine_ids' not in session or 'temp_epub_path' not in session:
+    book_state = get_book_state()
+    if not book_state:
         flash('No book loaded. Please upload an EPUB file.')
         return redirect(url_for('index'))
 
-    spine_ids = session['spine_ids']
-    temp_path = session['temp_epub_path']
-    toc_list = session.get('toc_list', [])
+    spine_ids = book_state['spine_ids']
+    temp_path = book_state['temp_epub_path']
+    toc_list = book_state['toc_list']
     total_items = len(spine_ids)
 
     # Validate index
@@ -265,44 +742,32 @@ def read_item(item_index):
         cleanup_temp_file()
         return redirect(url_for('index'))
 
-    # --- Always Fetch Original Content --- 
-    # Server no longer caches display content, client will check localStorage
+    # The page is a pure function of (book, chapter, JLPT toggle). /read/<n> is reused across
+    # books, so browsers must revalidate, but a matching ETag skips rendering entirely.
+    jlpt_enabled = session.get('jlpt_enabled', False)
+    etag = hashlib.md5(f"{session['book_id']}:{item_index}:{jlpt_enabled}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        return not_modified(etag, READ_CACHE_CONTROL)
+
+    # --- Fetch Original Content ---
+    # Rewritten chapter HTML is pre-rendered server-side; translations are cached client-side in localStorage
     try:
-        book = epub.read_epub(temp_path, options={"ignore_ncx": True})
-        item_id = spine_ids[item_index]
-        item = book.get_item_with_id(item_id)
-
-        if not item:
-            flash(f'Error: Could not find item with ID {item_id}.')
-            abort(404)
-
-        raw_content = item.get_content()
-        try: html_content = raw_content.decode('utf-8')
-        except UnicodeDecodeError: html_content = raw_content.decode('utf-8', 'ignore')
-
-        # Rewrite image paths in the original content
-        soup = BeautifulSoup(html_content, 'lxml')
-        current_item_dir = posixpath.dirname(item.file_name)
-        for img_tag in soup.find_all('img'):
-            original_src = img_tag.get('src')
-            if original_src:
-                absolute_image_path = posixpath.normpath(posixpath.join(current_item_dir, original_src))
-                img_tag['src'] = url_for('serve_epub_image', image_href=absolute_image_path)
-        
-        content_with_images = soup.prettify()
+        # Chapters were rewritten once at upload (see process_epub)
+        chapter_path = book_state['chapter_paths'][item_index]
 
         # --- Apply JLPT highlighting (Conditional based on toggle state) ---
-        content_to_render = content_with_images # Default to non-highlighted
-        jlpt_enabled = session.get('jlpt_enabled', False)
-        
         # Apply if toggle is enabled (Visibility controlled by client-side JS based on target language)
+        complete = True # False when JLPT highlighting fell back to the plain chapter
         if jlpt_enabled:
-            print("Applying JLPT highlighting (toggle enabled)...")
-            content_to_render = add_jlpt_highlighting(content_with_images)
+            log.debug("Applying JLPT highlighting (toggle enabled)...")
+            content_to_render, complete = load_jlpt_chapter(chapter_path)
+        else:
+            with open(chapter_path, 'rb') as f:
+                content_to_render = f.read().decode('utf-8')
         # --- End JLPT highlighting ---
         
     except Exception as e:
-        print(f"Error reading item {item_index} (ID: {spine_ids.get(item_index, 'N/A')}) from {temp_path}: {e}")
+        log.error("Error reading item %d (ID: %s) from %s: %s", item_index, spine_ids[item_index], temp_path, e)
         flash(f'Error reading book content: {e}')
         cleanup_temp_file()
         return redirect(url_for('index'))
@@ -311,65 +776,67 @@ def read_item(item_index):
     openai_key_configured = bool(app.config.get('OPENAI_API_KEY'))
     server_default_model = app.config.get('SERVER_DEFAULT_MODEL')
 
-    return render_template('reader.html',
+    response = Response(render_template('reader.html',
                            content=content_to_render, # Pass potentially highlighted content
                            current_index=item_index,
                            total_items=total_items,
                            toc=toc_list,
                            openai_key_configured=openai_key_configured,
                            server_default_model=server_default_model,
-                           jlpt_enabled=jlpt_enabled) # Pass toggle state only
+                           jlpt_enabled=jlpt_enabled)) # Pass toggle state only
+    if complete:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = READ_CACHE_CONTROL
+    else:
+        # The ETag names the highlighted page; a 304 would pin this fallback in the browser
+        response.headers['Cache-Control'] = FALLBACK_CACHE_CONTROL
+    return response
 
 # New route to serve images from the EPUB
-@app.route('/image/<path:image_href>')
-def serve_epub_image(image_href):
-    if 'temp_epub_path' not in session:
-        print("Error: No EPUB path in session for image request.")
+@app.route('/image/<book_id>/<path:image_href>')
+def serve_epub_image(book_id, image_href):
+    # No session here (see ImageRequestSessionInterface); the book id comes from the URL
+    book_state = _book_state.get(book_id)
+    if not book_state:
+        log.warning("No book loaded for image request.")
         abort(404)
 
-    temp_path = session['temp_epub_path']
+    temp_path = book_state['temp_epub_path']
 
     if not os.path.exists(temp_path):
-        print(f"Error: EPUB temp file not found: {temp_path}")
+        log.error("EPUB temp file not found: %s", temp_path)
         abort(404)
 
-    try:
-        # Re-read the EPUB (consider caching the book object in session/cache if performance is critical)
-        # ignore_ncx=True is a small optimization if we only need item access by href
-        book = epub.read_epub(temp_path, options={"ignore_ncx": True})
-
-        # Normalize the requested href just in case
-        normalized_href = posixpath.normpath(image_href)
-
-        image_item = book.get_item_with_href(normalized_href)
-
-        if image_item:
-            image_data = image_item.get_content()
-            # Guess MIME type from href
-            mime_type, _ = mimetypes.guess_type(normalized_href)
-            if not mime_type:
-                 # Fallback if guess fails - common for EPUB images
-                 if normalized_href.lower().endswith('.jpg') or normalized_href.lower().endswith('.jpeg'):
-                     mime_type = 'image/jpeg'
-                 elif normalized_href.lower().endswith('.png'):
-                     mime_type = 'image/png'
-                 elif normalized_href.lower().endswith('.gif'):
-                     mime_type = 'image/gif'
-                 elif normalized_href.lower().endswith('.svg'):
-                     mime_type = 'image/svg+xml'
-                 else:
-                     mime_type = 'application/octet-stream' # Generic fallback
-
-            print(f"Serving image: {normalized_href} with MIME type: {mime_type}")
-            return Response(image_data, mimetype=mime_type)
-        else:
-            print(f"Error: Image item not found in EPUB: {normalized_href}")
-            abort(404)
+    # Book ids are never reused, so an image URL always maps to the same bytes
+    etag = hashlib.md5(f"{book_id}:{image_href}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        return not_modified(etag, IMAGE_CACHE_CONTROL)
 
+    normalized_href = image_href
+    try:
+        image_index = get_image_index(temp_path)
+        entry = image_index.get(image_href)
+        if not entry:
+            # read_item already emits normalized hrefs; only other URLs need normalizing here
+            normalized_href = posixpath.normpath(image_href)
+            entry = image_index.get(normalized_href)
+        if entry:
+            member, mime_type = entry
+            image_data = get_zip_file(temp_path).read(member)
     except Exception as e:
-        print(f"Error serving image {image_href} from {temp_path}: {e}")
+        log.error("Error serving image %s from %s: %s", image_href, temp_path, e)
         abort(500)
 
+    if not entry:
+        log.warning("Image item not found in EPUB: %s", normalized_href)
+        abort(404)
+
+    log.debug("Serving image: %s with MIME type: %s", normalized_href, mime_type)
+    # conditional=True lets Werkzeug answer Range and If-Range requests against the buffer
+    response = send_file(io.BytesIO(image_data), mimetype=mime_type, etag=etag, conditional=True)
+    response.headers['Cache-Control'] = IMAGE_CACHE_CONTROL
+    return response
+
 # --- JLPT Toggle Endpoint --- #
 @app.route('/toggle_jlpt', methods=['POST'])
 def toggle_jlpt():
@@ -377,12 +844,83 @@ def toggle_jlpt():
     if data and 'enabled' in data:
         enabled_state = bool(data['enabled']) # Ensure boolean
         session['jlpt_enabled'] = enabled_state
-        print(f"JLPT Highlighting state set to: {enabled_state}")
+        log.debug("JLPT Highlighting state set to: %s", enabled_state)
         return jsonify({"success": True, "jlpt_enabled": enabled_state})
     else:
-        print("Invalid request to /toggle_jlpt")
+        log.warning("Invalid request to /toggle_jlpt")
         return jsonify({"success": False, "error": "Invalid payload"}), 400
 
+# One client (and its keep-alive connection pool) per API key, so consecutive
+# translations don't each pay for a fresh TLS handshake
+@lru_cache(maxsize=16)
+def _client_for(api_key):
+    return OpenAI(api_key=api_key)
+
+# A leading ``` / ```html and a trailing ``` the model sometimes wraps its answer in
+MARKDOWN_FENCE_RE = re.compile(r'^\s*```(?:html)?\s*|\s*```\s*$', re.IGNORECASE)
+
+# --- Translation Chunking (Start) ---
+# A long chapter is translated as several smaller requests in flight at once, so the wait
+# is roughly the slowest chunk rather than one long serial completion.
+TRANSLATE_CHUNK_SIZE = 3000 # Characters of HTML per request, roughly
+TRANSLATE_WORKERS = 4 # Concurrent OpenAI requests per process; keeps bursts under rate limits
+translate_executor = ThreadPoolExecutor(max_workers=TRANSLATE_WORKERS)
+
+def split_for_translation(content, max_chars=TRANSLATE_CHUNK_SIZE):
+    """Splits chapter HTML into (prefix, chunks, suffix). Chunks are runs of consecutive
+    top-level blocks of about max_chars each; prefix and suffix are the tags of any lone
+    wrapper elements (<section>, <div class="main">...) the blocks sit in, which are kept
+    out of the requests and put back around the translated chunks."""
+    unsplit = ('', [content], '')
+    if len(content) <= max_chars:
+        return unsplit
+    try:
+        container = lxml_html.fragment_fromstring(content, create_parent='div')
+    except etree.ParserError:
+        return unsplit
+    # Descend through wrappers that hold a single element and no text. Comments and
+    # processing instructions beside it aren't translated, so they go into prefix/suffix.
+    prefix, suffix = '', ''
+    marker = uuid.uuid4().hex
+    while not (container.text or '').strip() and not any((child.tail or '').strip() for child in container):
+        elements = [child for child in container if isinstance(child.tag, str)]
+        if len(elements) != 1:
+            break
+        wrapper = elements[0]
+        position = container.index(wrapper)
+        # An empty copy of the wrapper, cut at a marker, gives its start and end tags
+        shell = lxml_html.Element(wrapper.tag, dict(wrapper.attrib))
+        shell.text = marker
+        start_tag, end_tag = lxml_html.tostring(shell, encoding='unicode').split(marker)
+        prefix += ''.join(lxml_html.tostring(node, encoding='unicode') for node in container[:position]) + start_tag
+        suffix = end_tag + ''.join(lxml_html.tostring(node, encoding='unicode') for node in container[position + 1:]) + suffix
+        container = wrapper
+    if (container.text or '').strip():
+        return unsplit
+
+    chunks, group, size = [], [], 0
+    for child in container:
+        block = lxml_html.tostring(child, encoding='unicode') # Includes the tail text
+        if group and size + len(block) > max_chars:
+            chunks.append(''.join(group))
+            group, size = [], 0
+        group.append(block)
+        size += len(block)
+    if group:
+        chunks.append(''.join(group))
+    if len(chunks) < 2:
+        return unsplit
+    return prefix, chunks, suffix
+
+def translate_chunk(client, model, system_prompt, user_prompt):
+    completion = client.chat.completions.create(
+        model=model,
+        messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
+    )
+    # Stripped per chunk: a fence left between chunks would end up in the middle of the page
+    return MARKDOWN_FENCE_RE.sub('', completion.choices[0].message.content).strip()
+# --- Translation Chunking (End) ---
+
 # --- Translation Endpoint (Simplified) --- #
 @app.route('/translate', methods=['POST'])
 def translate_content():
@@ -396,6 +934,7 @@ def translate_content():
     model = data.get('model')
     user_api_key = data.get('api_key')
     cefr_level = data.get('cefr_level')
+    stream = bool(data.get('stream')) # Send the translation back as it's generated
 
     # Validate required fields
     if content is None or target_language is None or model is None:
@@ -412,35 +951,93 @@ def translate_content():
     user_prompt_prefix = f"Translate the following HTML content to {target_language}"
     if cefr_level: user_prompt_prefix += f", simplifying for CEFR level {cefr_level}. Preserve HTML tags."
     else: user_prompt_prefix += ". Preserve HTML tags."
-    full_user_prompt = f"{user_prompt_prefix}\n\nHTML Content:\n```html\n{content}\n```"
+    def user_prompt(html_content):
+        return f"{user_prompt_prefix}\n\nHTML Content:\n```html\n{html_content}\n```"
+    full_user_prompt = user_prompt(content)
+    prefix, chunks, suffix = split_for_translation(content)
 
-    # Logging (consider logging less in production)
-    print(f"--- Translation Request --- Language: {target_language}, Model: {model}, CEFR: {cefr_level or 'N/A'}")
-    # print(f"System Prompt: {system_prompt}") # Optional: Log full prompts only if debugging
-    # print(f"User Prompt: {full_user_prompt}")
+    log.info("Translation request: language=%s model=%s CEFR=%s chunks=%d", target_language, model, cefr_level or 'N/A', len(chunks))
+    log.debug("System prompt: %s", system_prompt)
+    log.debug("User prompt: %s", full_user_prompt)
 
     try:
-        client = OpenAI(api_key=api_key_to_use)
+        client = _client_for(api_key_to_use)
+        if len(chunks) > 1:
+            return translate_in_chunks(client, model, system_prompt, [user_prompt(chunk) for chunk in chunks], prefix, suffix, stream)
+
         completion = client.chat.completions.create(
             model=model,
-            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": full_user_prompt}]
+            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": full_user_prompt}],
+            stream=stream
         )
-        translated_text = completion.choices[0].message.content.strip()
+
+        if stream:
+            # Relay deltas as plain text; the client renders progressively and strips any
+            # markdown fence once the body is complete. Errors before the first token
+            # (auth, model name) are raised by create() above and still answer with JSON;
+            # later ones abort the response so the client doesn't cache a partial page.
+            def generate():
+                try:
+                    for chunk in completion:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            yield chunk.choices[0].delta.content
+                except Exception as e:
+                    log.error("Error while streaming translation: %s", e)
+                    raise
+                log.debug("Translation stream finished.")
+
+            return Response(generate(), mimetype='text/plain', headers={'X-Accel-Buffering': 'no'})
 
         # Attempt to remove potential markdown backticks anyway, just in case
-        if translated_text.startswith("```html"): translated_text = translated_text[7:].strip()
-        elif translated_text.startswith("```"): translated_text = translated_text[3:].strip()
-        if translated_text.endswith("```"): translated_text = translated_text[:-3].strip()
-        
-        print(f"Translation successful. First 100 chars: {translated_text[:100]}...")
+        translated_text = MARKDOWN_FENCE_RE.sub('', completion.choices[0].message.content).strip()
+
+        log.debug("Translation successful. First 100 chars: %.100s...", translated_text)
 
         # --- REMOVED Storing in Server Cache --- 
         
         return jsonify({"translated_text": translated_text})
 
     except Exception as e:
-        print(f"Error calling OpenAI API: {e}")
+        log.error("Error calling OpenAI API: %s", e)
         return jsonify({"error": f"Error during translation: {e}"}), 500
 
+def translate_in_chunks(client, model, system_prompt, user_prompts, prefix, suffix, stream):
+    futures = [translate_executor.submit(translate_chunk, client, model, system_prompt, prompt) for prompt in user_prompts]
+    try:
+        # Wait for the first chunk up front so auth/model errors still answer with JSON
+        first = futures[0].result()
+    except Exception:
+        for future in futures:
+            future.cancel()
+        raise
+
+    if stream:
+        # Each chunk is sent whole, in order, as soon as it and those before it are done
+        def generate():
+            try:
+                yield prefix + first
+                for future in futures[1:]:
+                    yield '\n' + future.result()
+                yield suffix
+            except Exception as e:
+                log.error("Error while streaming translation: %s", e)
+                raise
+            finally:
+                # Client went away or a chunk failed: drop chunks not yet sent to the API
+                for future in futures:
+                    future.cancel()
+            log.debug("Translation stream finished.")
+
+        return Response(generate(), mimetype='text/plain', headers={'X-Accel-Buffering': 'no'})
+
+    try:
+        translated_text = prefix + '\n'.join([first] + [future.result() for future in futures[1:]]) + suffix
+    except Exception:
+        for future in futures:
+            future.cancel()
+        raise
+    log.debug("Translation successful. First 100 chars: %.100s...", translated_text)
+    return jsonify({"translated_text": translated_text})
+
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file